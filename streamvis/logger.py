@@ -14,6 +14,7 @@ class DataLogger:
         self.configured_plots = set()
         self.scope = scope
         self.groups = []
+        self.new_groups = [] # groups not yet written to the log
         self.points = []
         self.batch = 0
         self.elem_count = 0
@@ -104,7 +105,7 @@ class DataLogger:
         for gi in indices:
             if self.find_group(group_name, gi) == -1:
                 new_group = util.make_group(self.scope, group_name, gi, **field_types)
-                self.fh.write(util.pack_message(new_group))
+                self.new_groups.append(new_group)
                 self.groups.append(new_group)
                 self.points.append(None)
 
@@ -124,9 +125,15 @@ class DataLogger:
             self.flush_buffer()
 
     def flush_buffer(self): 
-        packed = util.pack_messages([p for p in self.points if p is not None])
+        """
+        Write buffered groups and points in a single write.  pack_messages places
+        the groups ahead of any points that refer to them.
+        """
+        points = [p for p in self.points if p is not None]
+        packed = util.pack_messages(self.new_groups + points)
         self.fh.write(packed)
         self.fh.flush()
+        self.new_groups = []
         self.points = [None] * len(self.groups)
         self.elem_count = 0
 
@@ -1,5 +1,4 @@
 import numpy as np
-import re
 from bokeh.layouts import column, row
 from bokeh.models.dom import HTML
 from bokeh.models import Div, ColumnDataSource, Legend
@@ -34,8 +33,7 @@ class IndexPage:
         self.container.children[0].children[0] = Div(text=html)
         self.doc.add_root(self.container)
 
-        with self.server.page_lock.block():
-            self.server.pages[self.session_id] = self
+        self.server.attach_page(self)
 
     def schedule_callback(self):
         self.doc.add_next_tick_callback(self.update)
@@ -60,7 +58,7 @@ class PageLayout:
         self.box_elems = None
         self.widths = None
         self.heights = None
-        self.last_ord = 0 # the last seen ord value
+        self.next_ord = 0 # the first ord value not yet shown
 
     def destroy(self, session_context):
         self.server.delete_page(self.session_id)
@@ -229,8 +227,7 @@ class PageLayout:
         self.doc.add_root(self.container)
 
         # attach to page
-        with self.server.page_lock.block():
-            self.server.pages[self.session_id] = self
+        self.server.attach_page(self)
 
         self.update()
 
@@ -241,8 +238,8 @@ class PageLayout:
     def matching_groups(plot_schema, groups):
         matched = []
         for g in groups:
-            if (re.match(plot_schema['scope_pattern'], g.scope) and
-                    re.match(plot_schema['name_pattern'], g.name)):
+            if (util.make_matcher(plot_schema['scope_pattern'])(g.scope) and
+                    util.make_matcher(plot_schema['name_pattern'])(g.name)):
                 matched.append(g)
         return matched
 
@@ -302,26 +299,33 @@ class PageLayout:
         Update page with new data.
         """
         # print('in update')
-        # print(f'{self.last_ord=}, {self.server.global_ordinal=}')
-        with self.server.data_lock.block():
-            if self.last_ord == self.server.global_ordinal:
-                return
+        # print(f'{self.next_ord=}, {self.server.global_ordinal=}')
+        if not self.server.caught_up:
+            # the tables are unindexed until then; the first update_pages after
+            # catch-up delivers everything from next_ord on
+            return
+        # global_ordinal is published after its points commit, so it needs no lock.
+        # Points ingested after this read are left for the next update.
+        end_ord = self.server.global_ordinal
+        if self.next_ord == end_ord:
+            return
 
         update_glyph_fns = []
         for plot_name in self.plot_names:
             fig = self.get_plot(plot_name)
             groups = self.server.plot_groups[plot_name]
             plot_schema = self.server.schema[plot_name]
+            plot_data = self.server.new_cds_data_multi([g.id for g in groups],
+                    self.next_ord, end_ord)
             for group in groups:
-                new_data = self.server.new_cds_data(group.id, self.last_ord + 1)
+                new_data = plot_data.get(group.id)
                 if new_data is None:
                     continue
                 fn = partial(self.update_glyph_cb, plot_schema, plot_name, fig, group, new_data)
                 update_glyph_fns.append(fn)
 
-        with self.server.data_lock.block():
-            self.last_ord = self.server.global_ordinal
-        # print(f'In page {self.session_id} at position {self.last_ord}')
+        self.next_ord = end_ord
+        # print(f'In page {self.session_id} at position {self.next_ord}')
 
         # print(f'Scheduling {len(update_glyph_fns)} callbacks')
         for fn in update_glyph_fns:
@@ -1,48 +1,74 @@
 import fire
-import math
+import sys
 import time
 import numpy as np
-import re
 from streamvis import server, util
+from streamvis import data_pb2 as pb
 from streamvis.logger import DataLogger
 
-def _load(path):
+def _iter_messages(path):
+    """
+    Yield the messages in the log at `path` in order, parsing a chunk at a time so
+    that neither the file nor the full message list is held in memory
+    """
+    util.warn_if_slow_protobuf()
     fh = util.get_log_handle(path, 'rb')
-    packed = fh.read()
-    fh.close()
-    messages, remain_bytes = util.unpack(packed)
-    groups, all_points = util.separate_messages(messages)
-    return groups, all_points
+    try:
+        yield from util.unpack_stream(fh)
+    finally:
+        fh.close()
 
 def inventory(path, scopes='.*', names='.*'):
     """
     Print a summary inventory of data in `path` matching scopes
     """
-    groups, all_points = _load(path)
+    scope_match = util.make_matcher(scopes)
+    name_match = util.make_matcher(names)
+    groups = {} # group_id => Group, for matching groups in log order
+    counters = {} # group_id => point counter
+    totals = {} # group_id => number of data
+    for item in _iter_messages(path):
+        if type(item) is pb.Points:
+            count = counters.get(item.group_id)
+            if count is not None:
+                totals[item.group_id] += count(item)
+        elif scope_match(item.scope) and name_match(item.name):
+            groups[item.id] = item
+            counters[item.id] = util.make_point_counter(item)
+            totals[item.id] = 0
+
     # print(f'Inventory for {path}')
-    print('group.id\tscope\tname\tsignature\tindex\tnum_points')
-    def filter_fn(g):
-        return re.match(scopes, g.scope) and re.match(names, g.name)
-    for g in filter(filter_fn, groups):
-        points = list(filter(lambda p: p.group_id == g.id, all_points))
-        total_vals = sum(util.num_point_data(p) for p in points)
+    lines = ['group.id\tscope\tname\tsignature\tindex\tnum_points\n']
+    for g in groups.values():
         signature = ','.join(f'{f.name}:{f.type}' for f in g.fields)
-        print(f'{g.id}\t{g.scope}\t{g.name}\t{signature}\t{g.index}\t{total_vals}') 
+        lines.append(f'{g.id}\t{g.scope}\t{g.name}\t{signature}\t{g.index}\t{totals[g.id]}\n')
+    sys.stdout.write(''.join(lines))
 
 def export(path, scopes='.*'):
     """
-    Export contents of data in `path` matching `scopes` in tsv format
+    Export contents of data in `path` matching `scopes` in tsv format.  Rows are
+    written as their points are read, in log order.
     """
-    groups, all_points = _load(path)
-    filter_fn = lambda g: re.match(scopes, g.scope)
-    for g in filter(filter_fn, groups):
-        sig = tuple((f.name, f.type) for f in g.fields)
-        points = [pt for pt in all_points if pt.group_id == g.id]
-        for pt in points:
-            valtups = util.values_tuples(0, pt, sig)
-            for _, group_id, *vals in valtups:
-                valstr = '\t'.join(f'{v:.3f}' for v in vals)
-                print(f'{group_id}\t{pt.batch}\t{g.scope}\t{g.name}\t{g.index}\t{valstr}')
+    scope_match = util.make_matcher(scopes)
+    write = sys.stdout.write
+    formats = {} # group_id => (values getter, row format), for matching groups
+    for item in _iter_messages(path):
+        if type(item) is pb.Points:
+            fmt = formats.get(item.group_id)
+            if fmt is None:
+                continue
+            get_values, row_fmt = fmt
+            # one write per Points message rather than one print per row
+            batch = item.batch
+            write(''.join([row_fmt % (batch, *vals) for vals in zip(*get_values(item))]))
+        elif scope_match(item.scope):
+            g = item
+            sig = tuple((f.name, f.type) for f in g.fields)
+            # one %-format per row, with the group's constant columns baked in
+            scope, name = (s.replace('%', '%%') for s in (g.scope, g.name))
+            row_fmt = (f'{g.id}\t%d\t{scope}\t{name}\t{g.index}\t' +
+                    '\t'.join(['%.3f'] * len(sig)) + '\n')
+            formats[g.id] = util.values_getter(sig), row_fmt
     
 
 def demo_app(scope, path):
@@ -53,25 +79,21 @@ def demo_app(scope, path):
     buffer_max_elem = 100
     logger.init(path, buffer_max_elem)
 
-    N = 50
-    L = 20
-    left_data = np.random.randn(N, 2)
+    # line i of top_data is amps[i] * sin(phases[i] + freqs[i] * s)
+    phases = np.array([1, 1.5, 2], dtype=np.float32)[:,None]
+    freqs = np.array([1/10, 1/20, 1/15], dtype=np.float32)[:,None]
+    amps = np.array([1, 0.5, 1.5], dtype=np.float32)[:,None]
+    offsets = np.arange(10, dtype=np.float32)
+    s = np.empty_like(offsets) # reused each step; the logger copies what it writes
 
     for step in range(0, 10000, 10):
         time.sleep(1.0)
         # top_data[group, point], where group is a logical grouping of points that
         # form a line, and point is one of those points
-        top_data = np.array(
-                [
-                    [math.sin(1 + s / 10) for s in range(step, step+10)],
-                    [0.5 * math.sin(1.5 + s / 20) for s in range(step, step+10)],
-                    [1.5 * math.sin(2 + s / 15) for s in range(step, step+10)]
-                    ]) 
-
-        left_data = left_data + np.random.randn(N, 2) * 0.1
-        layer_mult = np.linspace(0, 10, L)
+        np.add(offsets, step, out=s)
+        top_data = amps * np.sin(phases + freqs * s)
 
-        logger.write('top_left', x=[list(range(step, step+10))], y=top_data)
+        logger.write('top_left', x=s[None,:], y=top_data)
 
         mid_data = top_data[:,0]
 
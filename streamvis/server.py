@@ -8,8 +8,10 @@ import sys
 import os
 import yaml
 import re
-import functools
+import hashlib
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from contextlib import contextmanager
 from google.cloud import storage
 from bokeh.application import Application
@@ -22,23 +24,66 @@ from bokeh.core.validation.warnings import EMPTY_LAYOUT, MISSING_RENDERERS
 import pdb
 
 from streamvis import util
+from streamvis import data_pb2 as pb
 from streamvis.page import IndexPage, PageLayout
 
+BULK_INSERT_ROWS = 64 # rows per multi-row INSERT in Server.load_rows
+MAX_QUERY_GROUPS = 997 # group ids per query in Server.new_cds_data_multi
+
 class LockManager:
+    """
+    A reentrant lock, acquired (blocking) with `with lock_manager:`
+    """
     def __init__(self):
-        self.lock = threading.Lock()
-        self.do_block = False
-
-    def block(self):
-        self.do_block = True
-        return self
+        self.lock = threading.RLock()
 
     def __enter__(self):
-        return self.lock.acquire(blocking=self.do_block)
+        self.lock.acquire()
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.lock.release()
-        self.do_block = False
+
+class RWLock:
+    """
+    A readers-writer lock.  Any number of threads may hold it with `read()` at once,
+    while `write()` holds it alone.  Waiting writers go ahead of new readers.  Not
+    reentrant.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self.cond:
+            while self.writing or self.writers_waiting > 0:
+                self.cond.wait()
+            self.readers += 1
+        try:
+            yield self
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if self.readers == 0:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.cond:
+            self.writers_waiting += 1
+            while self.writing or self.readers > 0:
+                self.cond.wait()
+            self.writers_waiting -= 1
+            self.writing = True
+        try:
+            yield self
+        finally:
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
 
 class CleanupHandler(Handler):
     def __init__(self, sv_server):
@@ -63,12 +108,28 @@ class Server:
 
         self.schema = {} # plot_name => schema
 
-        self.data_lock = LockManager()
+        self.data_lock = RWLock() # read: new_cds_data_multi; write: ingest
         self.tables = {} # table => sig (fetch_new_data)
-        self.groups = {} # group_id => Group (refresh_server)
-        self.global_ordinal = 0 # globally unique ID (refresh_server) (add_page)
+        self.insert_stmts = {} # table => single-row INSERT statement (fetch_new_data)
+        self.bulk_insert_stmts = {} # table => (rows, multi-row INSERT statement)
+        self.multi_select_stmts = {} # table => multi-group SELECT template
+        self.multi_dtypes = {} # table => dtype of multi-group SELECT rows
+        self.group_sig = {} # group_id => signature (fetch_new_data)
+        self.group_table = {} # group_id => table (fetch_new_data)
+        self.group_max_ord = {} # group_id => highest ordinal of its points (new_cds_data_multi)
+        # the next free ordinal (a globally unique point ID).  Published only after
+        # the inserts below it commit, so readers may read it without data_lock
+        self.global_ordinal = 0
         self.plot_to_sig = {} # plot_name => signature (fetch_new_data)
         self.blob_offset = 0 # (fetch_new_data)
+        # ingest runs on its own thread, so it never holds up the shared executor
+        self.ingest_executor = ThreadPoolExecutor(max_workers=1,
+                thread_name_prefix='streamvis-ingest')
+        # pages are updated in parallel with each other (update_pages)
+        self.page_executor = ThreadPoolExecutor(thread_name_prefix='streamvis-page')
+        self.caught_up = False # whether the initial read reached the end of the log
+        self.closed = False # set by shutdown; ends refresh_server, and later shutdowns
+        self.pending_indexes = [] # CREATE INDEX statements deferred until caught_up
         self.fetch_bytes = fetch_bytes
         self.refresh_seconds = refresh_seconds
         self.scope_pattern = scopes
@@ -76,15 +137,25 @@ class Server:
 
         self.page_lock = LockManager()
         self.pages = {} # map of session_id -> {page.PageLayout or page.IndexPage}
-        self.validate_patterns(scope_pattern=scopes, name_pattern=names)
+        self.page_snapshot = () # self.pages values, republished on change (update_pages)
+        patterns = self.validate_patterns(scope_pattern=scopes, name_pattern=names)
+        self.scope_match = patterns['scope_pattern'] # matcher for scope_pattern
+        self.name_match = patterns['name_pattern'] # matcher for name_pattern
     @staticmethod
     def validate_patterns(**kwargs):
+        """
+        Check that each pattern in `kwargs` compiles, returning arg_name => match
+        function (see util.make_matcher)
+        """
+        matchers = {}
         for arg_name, arg_val in kwargs.items():
             try:
-                re.compile(arg_val)
+                util.compile_pattern(arg_val)
             except re.error as ex:
                 raise RuntimeError(
                     f'Received invalid regex for {arg_name}: `{arg_val}`: {ex}')
+            matchers[arg_name] = util.make_matcher(arg_val)
+        return matchers
 
     def load_schema(self, schema_file):
         """
@@ -98,39 +169,68 @@ class Server:
                     f'Server could not open or parse schema file {schema_file}. '
                     f'Exception was: {ex}')
         # validate schema
+        plot_name_match = {}
         for plot_name, plot_schema in schema.items():
             try:
-                self.validate_patterns(name_pattern=plot_schema['name_pattern'])
+                patterns = self.validate_patterns(name_pattern=plot_schema['name_pattern'])
             except Exception as ex:
                 raise RuntimeError(
                     f'Plot {plot_name} in schema file {schema_file} '
                     f'contained error:\n{ex}')
+            plot_name_match[plot_name] = patterns['name_pattern']
         self.schema = schema
+        self.plot_name_match = plot_name_match # plot_name => matcher for name_pattern
+        self.scope_name_plots = {} # (scope, name) => matching plot names (add_group)
         self.plot_groups = { name: [] for name in self.schema.keys() } 
+        # plot_name => (scope, name) => index (scope_name_index)
+        self.scope_name_indexes = { name: {} for name in self.schema.keys() }
 
     def init_data(self, path):
         """
         Initialize the data source
         """
         self.path = path
-        self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+        # a local log is opened once and re-read as it grows.  A gs:// log is
+        # reopened for each fetch, since an open GFile won't see later writes
+        self.log_fh = None
+        self.reopen_log = path.startswith('gs://')
+        # statements are reused across refreshes, so keep room for one INSERT and
+        # one SELECT per table in the connection's prepared-statement cache
+        self.connection = sqlite3.connect(':memory:', check_same_thread=False,
+                cached_statements=256)
+        # keep sorter and index-build scratch space (see ingest_done) off disk
+        self.connection.execute('PRAGMA temp_store = MEMORY')
 
     @staticmethod
     def table_name(sig):
-        return 't' + str(abs(hash(sig)))
+        """
+        A table name for `sig` that is the same in every process
+        """
+        return 't' + hashlib.blake2b(repr(sig).encode(), digest_size=8).hexdigest()
 
-    def add_group(self, group):
+    def register_group(self, group):
         """
-        Add entry to self.groups, maybe self.points_tables and self.plot_sig
+        Record the signature and table of `group`, and its table in
+        self.tables if new.  Only the fetching thread writes these, so this needs
+        no lock.
         """
         sig = tuple((f.name, f.type) for f in group.fields)
         table = self.table_name(sig)
+        self.group_sig[group.id] = sig
+        self.group_table[group.id] = table
+        self.tables.setdefault(table, sig)
+
+    def add_group(self, group):
+        """
+        Maybe create the table of `group`, and add it to self.plot_groups.
+        `group` must already be registered.
+        """
+        sig = self.group_sig[group.id]
+        table = self.group_table[group.id]
 
-        self.groups[group.id] = group
         cursor = self.connection.cursor()
 
-        if table not in self.tables:
-            self.tables[table] = sig
+        if table not in self.insert_stmts:
             fields = ',\n'.join(f'{f.name} {util.get_sql_type(f.type)}' for f in
                     group.fields)
             create_table_stmt = f"""
@@ -145,112 +245,197 @@ class Server:
             ON {table} (group_id, ord)
             """
             cursor.execute(create_table_stmt)
-            cursor.execute(create_index_stmt)
+            if self.caught_up:
+                cursor.execute(create_index_stmt)
+            else:
+                self.pending_indexes.append(create_index_stmt)
+            width = len(sig) + 2
+            placeholder = '(' + ', '.join('?' for _ in range(width)) + ')'
+            self.insert_stmts[table] = f'INSERT INTO {table} VALUES {placeholder}'
+            # stay under SQLite's historical limit of 999 bound parameters
+            bulk_rows = min(BULK_INSERT_ROWS, 999 // width)
+            bulk_values = ', '.join(placeholder for _ in range(bulk_rows))
+            self.bulk_insert_stmts[table] = (bulk_rows,
+                    f'INSERT INTO {table} VALUES {bulk_values}')
+            proto_to_numpy = { pb.FieldType.INT: np.int64, pb.FieldType.FLOAT: np.float64 }
+            # one typed record per row, with the group id leading
+            self.multi_dtypes[table] = np.dtype([('group_id', np.int64)] +
+                    [(f.name, proto_to_numpy[f.type]) for f in group.fields])
+            # parameterized apart from the number of group ids (new_cds_data_multi)
+            sql_select = ', '.join(f.name for f in group.fields)
+            self.multi_select_stmts[table] = f"""
+            SELECT group_id, {sql_select}
+            FROM {table}
+            WHERE group_id IN ({{group_ids}})
+            AND ord >= ?
+            AND ord < ?
+            ORDER BY group_id, ord
+            """
 
-        for plot_name, plot_schema in self.schema.items():
+        for plot_name in self.schema.keys():
             existing_sig = self.plot_to_sig.setdefault(plot_name, sig)
             if sig != existing_sig:
                 raise RuntimeError(
                     f'Group {group} matching schema for plot {plot_name} '
                     f'had signature {sig} which did not match existing signature'
                     f' {existing_sig}')
-            if (re.match(self.scope_pattern, group.scope) and
-                re.match(self.name_pattern, group.name) and
-                re.match(plot_schema['name_pattern'], group.name)):
-                self.plot_groups[plot_name].append(group)
-                # print(f'{self.name_pattern} {self.scope_pattern} '
-                      # f'Adding {group.scope} {group.name}')
+
+        # groups repeat (scope, name) pairs, so match each pair against the plots
+        # only once
+        scope_name = group.scope, group.name
+        plot_names = self.scope_name_plots.get(scope_name)
+        if plot_names is None:
+            plot_names = ()
+            if self.scope_match(group.scope) and self.name_match(group.name):
+                plot_names = tuple(plot_name for plot_name, name_match in
+                        self.plot_name_match.items() if name_match(group.name))
+            self.scope_name_plots[scope_name] = plot_names
+        for plot_name in plot_names:
+            self.plot_groups[plot_name].append(group)
+            index_map = self.scope_name_indexes[plot_name]
+            index_map.setdefault(scope_name, len(index_map))
+            # print(f'{self.name_pattern} {self.scope_pattern} '
+                  # f'Adding {group.scope} {group.name}')
 
     def scope_name_index(self, plot_name, query_group):
         """
-        Computes the index of the (scope, name) pair associated with `plot_name` for
+        Returns the index of the (scope, name) pair associated with `plot_name` for
         the current server scope.  Indexes are assigned to each distinct (scope,
-        name) pair in the order they are encountered in the log file.
-        """
-        index = 0
-        temp = {}
-        query_scope_name = query_group.scope, query_group.name
-        with self.data_lock.block():
-            filter_fn = lambda g: re.match(self.scope_pattern, g.scope)
-            for group in filter(filter_fn, self.plot_groups[plot_name]):
-                scope_name = group.scope, group.name
-                if scope_name not in temp:
-                    temp[scope_name] = index
-                    index += 1
-                if scope_name == query_scope_name:
-                    break
-        return temp[query_scope_name]
-
-    def load_rows(self, table, rows):
+        name) pair in the order they are encountered in the log file (see
+        add_group).
+        """
+        return self.scope_name_indexes[plot_name][query_group.scope, query_group.name]
+
+    def load_rows(self, cursor, table, rows):
         if len(rows) == 0:
             return
-        num_fields = len(rows[0])
-        placeholder = ', '.join('?' for _ in range(num_fields))
-        insert_stmt = f'INSERT INTO {table} VALUES ({placeholder})'
-        cursor = self.connection.cursor()
-        cursor.executemany(insert_stmt, rows)
-
-    def add_points(self, points_list):
-        @functools.lru_cache
-        def get_table(group_id):
-            g = self.groups[group_id]
-            sig = tuple((f.name, f.type) for f in g.fields)
-            return self.table_name(sig)
+        # insert all but the remainder as multi-row INSERTs, which cross the
+        # statement boundary once per chunk rather than once per row
+        bulk_rows, bulk_stmt = self.bulk_insert_stmts[table]
+        num_bulk = len(rows) - len(rows) % bulk_rows
+        chunks = (list(chain.from_iterable(rows[i:i+bulk_rows]))
+                for i in range(0, num_bulk, bulk_rows))
+        cursor.executemany(bulk_stmt, chunks)
+        cursor.executemany(self.insert_stmts[table], rows[num_bulk:])
+
+    def points_rows(self, points_list):
+        """
+        Convert `points_list` to rows, assigning ordinals table by table in
+        `self.tables` order, starting from self.global_ordinal.  Returns
+        table => rows, and the next free ordinal.  Reads only state written by
+        the fetching thread, so needs no lock.
 
+        Also raises self.group_max_ord.  This happens before the rows are
+        inserted, so a reader may see a new maximum early but never late.
+        """
+        # one pass to bucket the points, rather than a scan per table
+        group_table = self.group_table
+        table_points = defaultdict(list) # table => [Points, ...]
+        for pt in points_list:
+            table_points[group_table[pt.group_id]].append(pt)
+
+        go = self.global_ordinal
+        group_max_ord = self.group_max_ord
+        table_rows = {}
         for table, sig in self.tables.items():
             rows = []
-            for pt in filter(lambda p: get_table(p.group_id) == table, points_list):
-                go = self.global_ordinal
-                vals = util.values_tuples(go, pt, sig)
-                self.global_ordinal += len(vals)
+            get_values = util.values_getter(sig) # once per table, not per message
+            for pt in table_points.get(table, ()):
+                vals = util.values_tuples(go, pt, get_values)
+                if len(vals) > 0:
+                    go += len(vals)
+                    group_max_ord[pt.group_id] = go - 1
                 rows.extend(vals)
-            self.load_rows(table, rows)
-
-    def new_cds_data(self, group_id, min_ordinal):
-        """
-        Return new CDS data for the glyph >= min_ordinal 
-        """
-        # print(f'in new_cds_data for {group_id} at {min_ordinal}')
-        with self.data_lock as lock_acquired:
-            if not lock_acquired:
-                return None
-            group = self.groups[group_id]
-            sig = tuple((f.name, f.type) for f in group.fields)
-            table = self.table_name(sig)
-            column_names = [s[0] for s in sig]
-            sql_select = ', '.join(column_names)
-            new_points_stmt = f"""
-            SELECT {sql_select} 
-            FROM {table} 
-            WHERE group_id = {group_id}
-            AND ord >= {min_ordinal}
-            ORDER BY ord
-            """
+            table_rows[table] = rows
+        return table_rows, go
+
+    def add_points(self, table_rows, end_ordinal):
+        """
+        Insert the rows from points_rows in a single transaction, and advance
+        self.global_ordinal past them
+        """
+        with self.connection:
             cursor = self.connection.cursor()
-            cursor.execute(new_points_stmt)
-            results = np.array(cursor.fetchall()).transpose()
-            if results.size == 0:
-                return None
-            return dict(zip(column_names, results))
+            for table, rows in table_rows.items():
+                self.load_rows(cursor, table, rows)
+        self.global_ordinal = end_ordinal
+
+    def new_cds_data_multi(self, group_ids, min_ordinal, end_ordinal):
+        """
+        Return group_id => new CDS data in [min_ordinal, end_ordinal) for those of
+        `group_ids` with any, querying each table once for all of its groups rather
+        than once per group
+        """
+        table_groups = defaultdict(list) # table => [group_id, ...]
+        for group_id in group_ids:
+            if self.group_max_ord.get(group_id, -1) >= min_ordinal:
+                table_groups[self.group_table[group_id]].append(group_id)
+
+        cds_data = {}
+        with self.data_lock.read():
+            cursor = self.connection.cursor()
+            for table, table_group_ids in table_groups.items():
+                dtype = self.multi_dtypes[table]
+                column_names = dtype.names[1:]
+                # two parameters are the ordinals; stay under SQLite's limit of 999
+                for beg in range(0, len(table_group_ids), MAX_QUERY_GROUPS):
+                    query_ids = table_group_ids[beg:beg+MAX_QUERY_GROUPS]
+                    placeholder = ', '.join('?' for _ in query_ids)
+                    stmt = self.multi_select_stmts[table].format(group_ids=placeholder)
+                    cursor.execute(stmt, (*query_ids, min_ordinal, end_ordinal))
+                    results = np.fromiter(cursor, dtype=dtype)
+                    if results.size == 0:
+                        continue
+                    # rows are sorted by group_id, so each group is one run
+                    bounds = np.flatnonzero(np.diff(results['group_id'])) + 1
+                    for part in np.split(results, bounds):
+                        group_id = int(part['group_id'][0])
+                        cds_data[group_id] = { name: np.ascontiguousarray(part[name])
+                                for name in column_names }
+        return cds_data
 
     def shutdown(self):
         """
         Cleanup actions.  What is needed for GCS?
         """
-        pass
+        # may be called more than once, but the executors only accept work once
+        if self.closed:
+            return
+        self.closed = True
+        # queued behind any fetch in progress, so the log isn't closed mid-read
+        self.ingest_executor.submit(self.close_log)
+        self.ingest_executor.shutdown(wait=False)
+        self.page_executor.shutdown(wait=False)
+
+    def close_log(self):
+        if self.log_fh is not None:
+            self.log_fh.close()
+            self.log_fh = None
 
     def fetch_new_data(self):
         """
-        Read any new data from the blob, updating the current position
+        Read up to `fetch_bytes` of new data from the blob, updating the current
+        position.  Returns True once the end of the blob is reached; until then,
+        refresh_server calls this again straight away to read the next chunk.
         """
         try:
-            fh = util.get_log_handle(self.path, 'rb')
+            if self.log_fh is None:
+                self.log_fh = util.get_log_handle(self.path, 'rb')
+            fh = self.log_fh
             fh.seek(self.blob_offset)
             packed = fh.read(self.fetch_bytes)
+            if len(packed) >= util.HEADER.size:
+                # extend the chunk to cover the first message, however large, so
+                # that each call makes progress
+                _, length = util.HEADER.unpack_from(packed)
+                first_end = util.HEADER.size + length
+                if first_end > len(packed):
+                    packed += fh.read(first_end - len(packed))
         except BaseException as ex:
             raise RuntimeError(f'Could not read from {self.path}: {ex}')
         finally:
-            fh.close()
+            if self.reopen_log:
+                self.close_log()
 
         if len(packed) == 0:
             return True
@@ -266,23 +451,63 @@ class Server:
                     f'Could not unpack messages from GCS log file {self.path}. '
                     f'Got exception: {ex}')
 
-        with self.data_lock.block():
+        # build the rows before taking the lock, so readers wait only on the inserts
+        for g in new_groups:
+            self.register_group(g)
+        table_rows, end_ordinal = self.points_rows(new_points)
+
+        with self.data_lock.write():
             for g in new_groups:
                 self.add_group(g)
-            self.add_points(new_points)
+            self.add_points(table_rows, end_ordinal)
         return end_reached
 
     def update_pages(self):
-        for page in self.pages.values():
-            page.update()
+        """
+        Update all pages concurrently, returning when all are done
+        """
+        # read without page_lock, since writers publish a new tuple on change
+        pages = self.page_snapshot
+        # list() waits for every update and re-raises the first error
+        list(self.page_executor.map(lambda page: page.update(), pages))
+
+    def refresh_once(self):
+        """
+        Fetch new data, then update the pages only if new points arrived.  Returns
+        True once the end of the blob is reached.
+        """
+        last_ordinal = self.global_ordinal
+        end_reached = self.fetch_new_data()
+        if not self.caught_up:
+            # hold page updates until the initial read is done and indexed
+            if not end_reached:
+                return end_reached
+            self.ingest_done()
+            last_ordinal = None
+        if self.global_ordinal != last_ordinal:
+            self.update_pages()
+        return end_reached
+
+    def ingest_done(self):
+        """
+        Called once the initial read reaches the end of the log.  Creates the
+        indexes that add_group deferred, so that the bulk of the initial inserts
+        did not have to maintain them.
+        """
+        with self.data_lock.write():
+            for create_index_stmt in self.pending_indexes:
+                self.connection.execute(create_index_stmt)
+            self.pending_indexes = []
+            self.caught_up = True
 
     async def refresh_server(self):
         loop = asyncio.get_running_loop()
-        while True:
-            end_reached = await loop.run_in_executor(None, self.fetch_new_data)
-            await loop.run_in_executor(None, self.update_pages)
-            cycle_delay = self.refresh_seconds if end_reached else 0.2
-            await asyncio.sleep(cycle_delay)
+        while not self.closed:
+            end_reached = await loop.run_in_executor(self.ingest_executor,
+                    self.refresh_once)
+            if end_reached:
+                await asyncio.sleep(self.refresh_seconds)
+            # otherwise more data is already waiting, so read it straight away
 
     def add_page(self, doc):
         """
@@ -309,31 +534,51 @@ class Server:
 
         doc.add_next_tick_callback(page.build_callback)
 
+    def attach_page(self, page):
+        with self.page_lock:
+            self.pages[page.session_id] = page
+            self.page_snapshot = tuple(self.pages.values())
+
     def delete_page(self, session_id):
-        with self.page_lock.block():
+        with self.page_lock:
             del self.pages[session_id]
+            self.page_snapshot = tuple(self.pages.values())
             print(f'deleted page {session_id}.  server now has {len(self.pages)} pages.')
 
 def make_server(port, schema_file, log_file, refresh_seconds=10, scopes='.*', names='.*'):  
     """
     Launch a server on `port` using `schema_file` to configure plots of data in `path`
     """
-    fetch_bytes = 10**10 # hack
+    try:
+        # a faster event loop, if installed.  This must happen before BokehServer
+        # creates its IOLoop
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ModuleNotFoundError:
+        pass
+    util.warn_if_slow_protobuf()
+    fetch_bytes = 64 << 20 # read the log in chunks, bounding the memory used per refresh
     sv_server = Server(fetch_bytes, refresh_seconds, scopes, names)
     sv_server.load_schema(schema_file)
     sv_server.init_data(log_file)
     handler = FunctionHandler(sv_server.add_page)
     cleanup = CleanupHandler(sv_server)
     bokeh_app = Application(handler, cleanup)
-    bokeh_server = BokehServer({'/': bokeh_app}, port=port)
+    # gzip HTTP responses, and deflate the websocket messages that carry the
+    # streamed glyph data.  Level 1 keeps per-message CPU cost low.
+    bokeh_server = BokehServer({'/': bokeh_app}, port=port, compress_response=True,
+            websocket_compression_level=1)
     bokeh_server.io_loop.asyncio_loop.create_task(sv_server.refresh_server())
 
-    def shutdown_handler(signum, frame):
+    def shutdown_handler(signum):
         print(f'Server received {signal.Signals(signum).name}')
-        sv_server.shutdown()
+        # run_until_shutdown then stops the Bokeh server, whose unload hook
+        # (CleanupHandler) calls sv_server.shutdown
+        bokeh_server.io_loop.stop()
 
-    signal.signal(signal.SIGQUIT, shutdown_handler)
-    signal.signal(signal.SIGHUP, shutdown_handler) 
+    asyncio_loop = bokeh_server.io_loop.asyncio_loop
+    asyncio_loop.add_signal_handler(signal.SIGQUIT, shutdown_handler, signal.SIGQUIT)
+    asyncio_loop.add_signal_handler(signal.SIGHUP, shutdown_handler, signal.SIGHUP)
 
     print(f'Web server is running on http://localhost:{port}')
     bokeh_server.run_until_shutdown()
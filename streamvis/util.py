@@ -1,8 +1,24 @@
+import sys
 import numpy as np
 import random
+import re
+import struct
+import functools
+from operator import attrgetter
+from google.protobuf.internal import api_implementation
+from itertools import repeat
 from . import data_pb2 as pb
 import pdb
 
+# one-byte kind code preceding each message in the log
+MESSAGE_KINDS = { pb.Group: 0, pb.Points: 1 }
+KIND_MESSAGES = { kind: cls for cls, kind in MESSAGE_KINDS.items() }
+# message header: one-byte kind, then the four-byte big-endian body length
+HEADER = struct.Struct('>BI')
+
+# characters that make a pattern more than a literal prefix (see make_matcher)
+REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+
 def get_log_handle(path, mode):
     """
     Provide an ordinary filehandle or GFile, whichever is needed, to avoid
@@ -18,19 +34,47 @@ def get_log_handle(path, mode):
         fh = open(path, mode)
     return fh
 
+@functools.lru_cache(maxsize=256)
+def compile_pattern(pattern):
+    """
+    Return `re.compile(pattern)`, compiling each distinct pattern only once
+    """
+    return re.compile(pattern)
+
+@functools.lru_cache(maxsize=256)
+def make_matcher(pattern):
+    """
+    Return a predicate equivalent to `re.match(pattern, s)`.  The match-everything
+    patterns skip the regex engine entirely, and a pattern with no metacharacters
+    is a plain prefix test.
+    """
+    if pattern in ('.*', '.*?', ''):
+        return lambda s: True
+    if REGEX_METACHARS.isdisjoint(pattern):
+        return lambda s: s.startswith(pattern)
+    return compile_pattern(pattern).match
+
+def warn_if_slow_protobuf():
+    """
+    Warn on stderr if protobuf is using its pure-python backend
+    """
+    if api_implementation.Type() == 'python':
+        print('Warning: protobuf is using its pure-python backend, which parses '
+              'logs far more slowly.  Install protobuf>=4.21 for the upb backend.',
+              file=sys.stderr)
+
 def separate_messages(messages):
     """
     Separate the messages into an array of Point and PointGroup messages
     """
     groups = []
     points = []
+    dispatch = { pb.Group: groups.append, pb.Points: points.append }
     for item in messages:
-        if isinstance(item, pb.Group):
-            groups.append(item)
-        elif isinstance(item, pb.Points):
-            points.append(item)
-        else:
+        append = dispatch.get(type(item))
+        if append is None:
             raise RuntimeError(f'Received unknown message type {type(item)}')
+        append(item)
     return groups, points 
 
 def pack_message(message):
@@ -38,12 +82,7 @@ def pack_message(message):
     Create a delimited protobuf message as bytes
     """
     content = message.SerializeToString()
-    length_code = len(content).to_bytes(4, 'big')
-    if isinstance(message, pb.Group):
-        kind_code = b'\x00'
-    elif isinstance(message, pb.Points):
-        kind_code = b'\x01'
-    return kind_code + length_code + content 
+    return HEADER.pack(MESSAGE_KINDS[type(message)], len(content)) + content 
 
 def pack_messages(messages):
     """
@@ -61,24 +100,40 @@ def unpack(packed):
     items = []
     off = 0
     end = len(packed)
-    while off != end:
-        kind_code = packed[off:off+1]
-        length_code = packed[off+1:off+5]
-        kind = int.from_bytes(kind_code, 'big')
-        length = int.from_bytes(length_code, 'big')
-        content = packed[off+5:off+5+length]
-        if len(content) != length:
+    unpack_header = HEADER.unpack_from
+    # stop at a partial header or a partial message body
+    while end - off >= HEADER.size:
+        kind, length = unpack_header(packed, off)
+        body_end = off + HEADER.size + length
+        if body_end > end:
             break
-        if kind == 0:
-            item = pb.Group()
-        elif kind == 1:
-            item = pb.Points()
-        else:
+        message_cls = KIND_MESSAGES.get(kind)
+        if message_cls is None:
             raise RuntimeError(f'Unknown kind {kind}, length {length}')
-        item.ParseFromString(content)
-        off += 5 + length
+        item = message_cls()
+        item.ParseFromString(packed[off+HEADER.size:body_end])
+        off = body_end
         items.append(item)
-    return items, len(packed[off:])
+    return items, end - off
+
+def unpack_stream(fh, chunk_size=2**20):
+    """
+    Incrementally unpack messages from the open file handle `fh`, reading
+    `chunk_size` bytes at a time.  Yields each message once parsed, so only one
+    chunk plus a partial message is held in memory.  As with `unpack`, a
+    trailing partial message is ignored.
+    """
+    # kept as bytes rather than bytearray, since protobuf parses bytes slices
+    # without an extra copy
+    tail = b''
+    while True:
+        chunk = fh.read(chunk_size)
+        if len(chunk) == 0:
+            return
+        buf = tail + chunk
+        items, remain_bytes = unpack(buf)
+        tail = buf[len(buf) - remain_bytes:]
+        yield from items
 
 def validate(points, group):
     if points.group_id != group.id:
@@ -114,20 +169,35 @@ def points_to_cds(points_list, group):
     print('ending convert')
     return cds 
 
-def values_tuples(gid_beg, points, sig):
+@functools.lru_cache
+def values_getter(sig):
+    """
+    `sig`: a signature derived from Group.fields
+    Returns a function mapping a Points message to its list of per-field value
+    containers.  The floats/ints choice for each field is resolved once per
+    signature rather than on every call.
+    """
+    proto_to_getter = {
+            pb.FieldType.FLOAT: attrgetter('floats.value'),
+            pb.FieldType.INT: attrgetter('ints.value')
+            }
+    getters = [ proto_to_getter[typ] for _, typ in sig ]
+    def get_values(points):
+        return [ get(value) for get, value in zip(getters, points.values) ]
+    return get_values
+
+def values_tuples(gid_beg, points, get_values):
     """
     `points`: a Points message
-    `sig`: a signature derived from Group.fields 
+    `get_values`: values_getter(sig) for the signature of its group
     Gets the points values as a list of tuples, suitable for insert
     into a relational table.
     """
-    vals = []
-    for value, (_, typ) in zip(points.values, sig):
-        if typ == pb.FieldType.FLOAT:
-            vals.append(value.floats.value)
-        elif typ == pb.FieldType.INT:
-            vals.append(value.ints.value)
-    return [(gid, points.group_id, *v) for gid, v in enumerate(zip(*vals), gid_beg)]
+    vals = get_values(points)
+    num_data = len(vals[0])
+    # zip the columns into rows in C, rather than unpacking each row in Python
+    return list(zip(range(gid_beg, gid_beg + num_data),
+        repeat(points.group_id, num_data), *vals))
 
 def make_group(scope, name, index, /, **field_types):
     """
@@ -180,9 +250,8 @@ def add_to_point(group, point, /, **data):
     """
     validate(group, data)
     for value, field in zip(point.values, group.fields):
-        nums = data[field.name]
-        if nums.ndim == 0:
-            nums = nums[None]
+        # tolist() converts in one C loop rather than boxing each numpy scalar
+        nums = data[field.name].reshape(-1).tolist()
         if field.type == pb.FieldType.INT:
             value.ints.value.extend(nums)
         elif field.type == pb.FieldType.FLOAT:
@@ -196,6 +265,17 @@ def num_point_data(point):
     elif data_name == 'ints':
         return len(values.ints.value)
 
+def make_point_counter(group):
+    """
+    Return a function giving the number of data in a pb.Points of `group`.  This
+    resolves which repeated field to count once per group, rather than calling
+    WhichOneof on every point as num_point_data does.
+    """
+    if group.fields[0].type == pb.FieldType.FLOAT:
+        return lambda point: len(point.values[0].floats.value)
+    elif group.fields[0].type == pb.FieldType.INT:
+        return lambda point: len(point.values[0].ints.value)
+
 def get_sql_type(field_type):
     return pb.FieldType.Name(field_type)
 